@@ -1,11 +1,9 @@
 import json
 import logging
 import os
+import time
 import streamlit as st
 from dotenv import load_dotenv
-import mlflow
-from mlflow.types.responses import ResponsesAgentRequest
-from model_serving_utils import get_agent, log_user_feedback
 
 # Load .env file for local development (ignored when deployed to Databricks Apps)
 load_dotenv()
@@ -23,31 +21,16 @@ assert SERVING_ENDPOINT, \
      "'serving_endpoint' with CAN_QUERY permissions, as described in "
      "https://docs.databricks.com/aws/en/generative-ai/agent-framework/chat-app#deploy-the-databricks-app")
 
-# Configure MLflow experiment for tracing
-# Set tracking URI if provided via environment variable
-MLFLOW_TRACKING_URI = os.getenv('MLFLOW_TRACKING_URI')
-if MLFLOW_TRACKING_URI:
-    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-    logger.info(f"MLflow tracking URI set to: {MLFLOW_TRACKING_URI}")
-else:
-    logger.info(f"MLflow tracking URI: {mlflow.get_tracking_uri()}")
+# Coalesce streaming display updates: flush at most every interval or once enough characters are pending
+STREAM_FLUSH_INTERVAL_S = 0.05
+STREAM_FLUSH_CHARS = 32
 
-MLFLOW_EXPERIMENT_ID = os.getenv('MLFLOW_EXPERIMENT_ID')
-if MLFLOW_EXPERIMENT_ID:
-    try:
-        mlflow.set_experiment(experiment_id=MLFLOW_EXPERIMENT_ID)
-        logger.info(f"MLflow experiment set to ID: {MLFLOW_EXPERIMENT_ID}")
-    except Exception as e:
-        logger.warning(f"Failed to set experiment by ID: {e}. Falling back to experiment name.")
-        mlflow.set_experiment("/Shared/streamlit-chatbot-app")
-        logger.info("MLflow experiment set to /Shared/streamlit-chatbot-app")
-else:
-    # Fallback to experiment name if ID not provided
-    mlflow.set_experiment("/Shared/streamlit-chatbot-app")
-    logger.info("MLflow experiment set to /Shared/streamlit-chatbot-app")
-
-# Initialize ResponsesAgent
-agent = get_agent(SERVING_ENDPOINT)
+# Long chats render older messages as a single markdown element; only recent ones get chat containers
+HISTORY_COLLAPSE_THRESHOLD = 20
+RECENT_MESSAGES = 4
+
+# How often the status of feedback being logged in the background is re-checked
+FEEDBACK_POLL_INTERVAL_S = 1.0
 
 
 def get_user_info():
@@ -60,60 +43,279 @@ def get_user_info():
     )
 
 
-user_info = get_user_info()
+# Shared JSON codec instances for formatting tool call arguments
+_DECODE = json.JSONDecoder().decode
+_ENCODE = json.JSONEncoder(indent=2).encode
 
 
-def render_agent_response(sections, streaming_text=""):
+def _safe_pretty(args):
+    """Pretty-print tool call arguments as JSON, falling back to the raw string."""
+    try:
+        return _ENCODE(_DECODE(args))
+    except (TypeError, ValueError):
+        return args
+
+
+def render_section(section_type, content):
     """
-    Build markdown for all response sections.
+    Build markdown for a single response section.
 
     Args:
-        sections: List of (type, content) tuples
-        streaming_text: Currently streaming text to append with cursor
+        section_type: Section type ("text", "agent_name", "tool_call", "tool_output")
+        content: Section content
 
     Returns:
-        Tuple of (markdown_string, full_text_response)
+        Markdown string for the section (empty if the section is not displayed)
+    """
+    if section_type == "text":
+        return content
+
+    elif section_type == "agent_name":
+        return f"\n\n<details>\n<summary>🤖 Agent: {content}</summary>\n\nRouting to agent: {content}\n\n</details>\n"
+
+    elif section_type == "tool_call":
+        return f"\n\n<details>\n<summary>🔧 Tool Call: {content['name']}</summary>\n\n```json\n{content['args_pretty']}\n```\n\n</details>\n"
+
+    elif section_type == "tool_output":
+        # Check if output looks like structured data (tables, large text)
+        # Length check first; the pipe count only scans a bounded prefix
+        is_large_table = len(content) > 1000 or content.count('|', 0, 2000) > 20
+
+        if is_large_table:
+            # For large tables/data, just show a summary in the expander
+            lines = content.split('\n')[:3]
+            preview = '\n'.join(lines)
+            return f"\n\n<details>\n<summary>📤 Tool Output (large dataset - click to expand)</summary>\n\n```\n{preview}\n...\n[{len(content)} characters total]\n```\n\n</details>\n"
+        else:
+            # Show smaller outputs normally
+            display_output = content if len(content) <= 500 else content[:500] + "\n\n... (truncated)"
+            return f"\n\n<details>\n<summary>📤 Tool Output</summary>\n\n```\n{display_output}\n```\n\n</details>\n"
+
+    return ""
+
+
+class SectionRenderer:
     """
-    markdown_parts = []
-    full_text_parts = []
+    Incrementally build markdown for an agent response.
 
-    for section_type, content in sections:
+    Sections are append-only, so each one is formatted once when it is added and the
+    joined markdown is cached; rendering while streaming only appends the live text.
+    """
+
+    def __init__(self):
+        self.parts = []  # Markdown for each displayed section
+        self.text_parts = []  # Plain text sections for the stored chat history
+        self.prefix = ""
+        self.count = 0
+
+    def append(self, section_type, content):
+        """Add a finalized (type, content) section."""
+        self.count += 1
         if section_type == "text":
-            markdown_parts.append(content)
-            full_text_parts.append(content)
+            self.text_parts.append(content)
+        markdown = render_section(section_type, content)
+        if markdown:
+            self.parts.append(markdown)
+            self.prefix = "".join(self.parts)
 
-        elif section_type == "agent_name":
-            markdown_parts.append(f"\n\n<details>\n<summary>🤖 Agent: {content}</summary>\n\nRouting to agent: {content}\n\n</details>\n")
+    def render(self, streaming_text=""):
+        """Return markdown for all sections, plus any streaming text with a cursor."""
+        if streaming_text:
+            return self.prefix + "\n\n" + streaming_text + "▌"
+        return self.prefix
 
-        elif section_type == "tool_call":
-            try:
-                formatted_args = json.dumps(json.loads(content['args']), indent=2)
-            except:
-                formatted_args = content['args']
-            markdown_parts.append(f"\n\n<details>\n<summary>🔧 Tool Call: {content['name']}</summary>\n\n```json\n{formatted_args}\n```\n\n</details>\n")
-
-        elif section_type == "tool_output":
-            # Skip displaying tool output if it's just a handoff message or contains large tables
-            if content and not content.startswith("Handed off to:"):
-                # Check if output looks like structured data (tables, large text)
-                is_large_table = content.count('|') > 20 or len(content) > 1000
-
-                if is_large_table:
-                    # For large tables/data, just show a summary in the expander
-                    lines = content.split('\n')[:3]
-                    preview = '\n'.join(lines)
-                    markdown_parts.append(f"\n\n<details>\n<summary>📤 Tool Output (large dataset - click to expand)</summary>\n\n```\n{preview}\n...\n[{len(content)} characters total]\n```\n\n</details>\n")
+    @property
+    def text(self):
+        """Plain text response stored in chat history."""
+        return "\n\n".join(self.text_parts)
+
+
+def stream_response_markdown(events, renderer):
+    """
+    Consume Responses API stream events and yield markdown snapshots for display.
+
+    Text deltas are coalesced so a snapshot is yielded at most every STREAM_FLUSH_INTERVAL_S
+    or STREAM_FLUSH_CHARS characters; other display changes are yielded as they happen.
+
+    Args:
+        events: Iterable of stream events from the agent
+        renderer: SectionRenderer that accumulates the finalized sections
+
+    Yields:
+        Markdown strings for the response placeholder
+    """
+    logger.info("Starting streaming response...")
+    event_count = 0
+
+    current_text = ""
+    current_item_id = None
+    streamed_item_ids = set()  # Track which items we've streamed
+
+    # Streamed characters not yet sent to the placeholder
+    pending_chars = 0
+    last_flush_ts = time.monotonic()
+
+    for event in events:
+        event_count += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Event %d: type=%s, event class=%s", event_count, event.type, type(event).__name__)
+
+        # Flush any coalesced text before handling other events
+        if pending_chars and event.type != "response.output_text.delta":
+            yield renderer.render(current_text)
+            pending_chars = 0
+            last_flush_ts = time.monotonic()
+
+        # Handle different event types from the Responses API
+        if event.type == "response.output_text.delta":
+            # Accumulate text deltas for the current streaming message
+            delta = getattr(event, 'delta', None)
+            if delta:
+                item_id = getattr(event, 'item_id', None)
+                if item_id != current_item_id:
+                    # New text stream starting
+                    if current_text:
+                        # Save previous text section
+                        renderer.append("text", current_text)
+                        streamed_item_ids.add(current_item_id)
+                    current_text = delta
+                    current_item_id = item_id
                 else:
-                    # Show smaller outputs normally
-                    display_output = content if len(content) <= 500 else content[:500] + "\n\n... (truncated)"
-                    markdown_parts.append(f"\n\n<details>\n<summary>📤 Tool Output</summary>\n\n```\n{display_output}\n```\n\n</details>\n")
+                    current_text += delta
+
+                # Update display (only during streaming text), coalescing rapid deltas
+                pending_chars += len(delta)
+                now = time.monotonic()
+                if pending_chars >= STREAM_FLUSH_CHARS or now - last_flush_ts >= STREAM_FLUSH_INTERVAL_S:
+                    yield renderer.render(current_text)
+                    pending_chars = 0
+                    last_flush_ts = now
+
+        elif event.type == "response.output_item.done":
+            # Save any accumulated text first
+            if current_text:
+                renderer.append("text", current_text)
+                streamed_item_ids.add(current_item_id)
+                current_text = ""
+                current_item_id = None
+
+            item = getattr(event, 'item', None)
+            if item is not None:
+                item_id = getattr(item, 'id', None)
+                item_type = getattr(item, 'type', None)
+                logger.info(f"Item type: {item_type or 'unknown'}, id: {item_id}")
+
+                # Handle different item types
+                if item_type == 'function_call':
+                    # Show tool call
+                    tool_name = getattr(item, 'name', 'unknown')
+                    tool_args = getattr(item, 'arguments', '{}')
+                    # Format arguments once here rather than on every render
+                    renderer.append("tool_call", {"name": tool_name, "args_pretty": _safe_pretty(tool_args)})
+                    # Update display
+                    yield renderer.render()
+
+                elif item_type == 'function_call_output':
+                    # Show tool output, skipping empty output and handoff messages
+                    output = getattr(item, 'output', '')
+                    if output and not output.startswith("Handed off to:"):
+                        renderer.append("tool_output", output)
+                        # Update display
+                        yield renderer.render()
+
+                elif item_type == 'message':
+                    # Only process message items that we haven't already streamed
+                    if item_id not in streamed_item_ids:
+                        # Extract any complete text from message items
+                        for content_item in getattr(item, 'content', None) or ():
+                            if getattr(content_item, 'type', None) != 'output_text':
+                                continue
+                            text = getattr(content_item, 'text', None)
+                            if text is None:
+                                continue
+                            # Check if this is agent name metadata (contains <name>)
+                            if text.startswith('<name>') and text.endswith('</name>'):
+                                agent_name = text[6:-7]  # Extract name
+                                renderer.append("agent_name", agent_name)
+                                # Update display
+                                yield renderer.render()
+                            elif text != "EMPTY":
+                                # Add non-streamed message text
+                                renderer.append("text", text)
+                                # Update display
+                                yield renderer.render()
 
-    # Show currently streaming text with cursor
-    if streaming_text:
-        markdown_parts.append("\n\n" + streaming_text + "▌")
-        full_text_parts.append(streaming_text)
+    # Keep any trailing text that was not closed by an output_item.done event
+    if current_text:
+        renderer.append("text", current_text)
 
-    return "".join(markdown_parts), "\n\n".join(full_text_parts)
+    logger.info(f"Stream complete. Total events: {event_count}, Sections: {renderer.count}")
+
+
+def _feedback_failed(future):
+    """Whether background feedback logging finished without logging the feedback."""
+    return future is not None and future.done() and (future.exception() is not None or not future.result())
+
+
+@st.fragment(run_every=FEEDBACK_POLL_INTERVAL_S)
+def _feedback_status(client_request_id):
+    """
+    Show the status of feedback being logged in the background, re-checking until it completes.
+
+    A failed submission reruns the app so render_feedback can report it and offer the buttons again.
+    """
+    future = st.session_state.feedback_futures.get(client_request_id)
+    feedback_type = st.session_state.feedback_type[client_request_id]
+    if _feedback_failed(future):
+        st.rerun()
+    elif future is not None and not future.done():
+        st.caption(f"Submitting feedback: {feedback_type}...")
+    else:
+        st.caption(f"✓ Feedback submitted: {feedback_type}")
+
+
+@st.fragment
+def render_feedback(idx, client_request_id, user_id):
+    """
+    Show feedback buttons for an assistant message, or the submitted feedback.
+
+    Runs as a fragment so a button click only reruns this widget, not the whole chat.
+    """
+    # Feedback is logged in the background; if it failed, report it and offer the buttons again
+    future = st.session_state.feedback_futures.get(client_request_id)
+    if _feedback_failed(future):
+        del st.session_state.feedback_futures[client_request_id]
+        st.session_state.feedback_submitted.discard(client_request_id)
+        st.error("Failed to submit feedback. Please check the logs.")
+
+    # Only show buttons if feedback hasn't been submitted for this message
+    if client_request_id not in st.session_state.feedback_submitted:
+        st.markdown("---")
+        col1, col2, col3 = st.columns([1, 1, 10])
+        with col1:
+            if st.button("👍", key=f"thumbs_up_{idx}"):
+                logger.info(f"User clicked thumbs up for message {idx}, client_request_id: {client_request_id}")
+                st.session_state.feedback_futures[client_request_id] = log_user_feedback(
+                    client_request_id, True, user_id=user_id
+                )
+                st.session_state.feedback_submitted.add(client_request_id)
+                st.session_state.feedback_type[client_request_id] = "positive"
+                st.rerun(scope="fragment")
+        with col2:
+            if st.button("👎", key=f"thumbs_down_{idx}"):
+                logger.info(f"User clicked thumbs down for message {idx}, client_request_id: {client_request_id}")
+                st.session_state.feedback_futures[client_request_id] = log_user_feedback(
+                    client_request_id, False, user_id=user_id
+                )
+                st.session_state.feedback_submitted.add(client_request_id)
+                st.session_state.feedback_type[client_request_id] = "negative"
+                st.rerun(scope="fragment")
+    elif future is not None and not future.done():
+        # Polls in place until logging completes
+        _feedback_status(client_request_id)
+    else:
+        feedback_type = st.session_state.feedback_type[client_request_id]
+        st.caption(f"✓ Feedback submitted: {feedback_type}")
 
 
 # Streamlit app
@@ -121,8 +323,16 @@ if "visibility" not in st.session_state:
     st.session_state.visibility = "visible"
     st.session_state.disabled = False
 
+# Forwarded user headers are constant for a session
+if "user_info" not in st.session_state:
+    st.session_state.user_info = get_user_info()
+user_info = st.session_state.user_info
+
+# Client request IDs with submitted feedback, and the feedback given (for the caption)
 if "feedback_submitted" not in st.session_state:
-    st.session_state.feedback_submitted = {}
+    st.session_state.feedback_submitted = set()
+    st.session_state.feedback_type = {}
+    st.session_state.feedback_futures = {}
 
 st.title("🧱 Agent Bricks Chatbot")
 
@@ -134,54 +344,85 @@ st.markdown(
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Conversation input sent to the agent, appended in place alongside messages
+if "agent_input" not in st.session_state:
+    st.session_state.agent_input = []
+
 if "client_request_ids" not in st.session_state:
     st.session_state.client_request_ids = []
 
+
+# Heavy imports (mlflow, databricks-sdk) are deferred until after the UI shell has rendered
+MLFLOW_TRACKING_URI = os.getenv('MLFLOW_TRACKING_URI')
+MLFLOW_EXPERIMENT_ID = os.getenv('MLFLOW_EXPERIMENT_ID')
+FALLBACK_EXPERIMENT_NAME = "/Shared/streamlit-chatbot-app"
+
+
+@st.cache_resource
+def _ensure_experiment(exp_id, fallback_name):
+    """
+    Configure MLflow tracking and the experiment for tracing once per process.
+
+    Args:
+        exp_id: MLflow experiment ID, or None to use fallback_name
+        fallback_name: Experiment name used when exp_id is unset or cannot be set
+    """
+    import mlflow
+
+    # Set tracking URI if provided via environment variable
+    if MLFLOW_TRACKING_URI:
+        mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+        logger.info(f"MLflow tracking URI set to: {MLFLOW_TRACKING_URI}")
+    else:
+        logger.info(f"MLflow tracking URI: {mlflow.get_tracking_uri()}")
+
+    if exp_id:
+        try:
+            mlflow.set_experiment(experiment_id=exp_id)
+            logger.info(f"MLflow experiment set to ID: {exp_id}")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to set experiment by ID: {e}. Falling back to experiment name.")
+
+    # Fallback to experiment name if ID not provided or not usable
+    mlflow.set_experiment(fallback_name)
+    logger.info(f"MLflow experiment set to {fallback_name}")
+    return True
+
+
+_ensure_experiment(MLFLOW_EXPERIMENT_ID, FALLBACK_EXPERIMENT_NAME)
+
+from model_serving_utils import get_agent, log_user_feedback, tag_trace_with_client_request_id  # noqa: E402
+
+# Initialize ResponsesAgent; get_agent creates it once per process, so reruns reuse its client and connection pool
+agent = get_agent(SERVING_ENDPOINT)
+
 # Display chat messages from history on app rerun
-for idx, message in enumerate(st.session_state.messages):
+recent_start = 0
+if len(st.session_state.messages) > HISTORY_COLLAPSE_THRESHOLD:
+    recent_start = len(st.session_state.messages) - RECENT_MESSAGES
+    st.markdown("\n\n---\n\n".join(
+        f"**{message['role'].capitalize()}:**\n\n{message['content']}"
+        for message in st.session_state.messages[:recent_start]
+    ))
+
+for idx, message in enumerate(st.session_state.messages[recent_start:], start=recent_start):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
         # Show feedback buttons for assistant messages
         if message["role"] == "assistant":
-            # Calculate which trace this message corresponds to
-            assistant_idx = sum(1 for m in st.session_state.messages[:idx+1] if m["role"] == "assistant") - 1
-
-            if assistant_idx < len(st.session_state.client_request_ids):
-                client_request_id = st.session_state.client_request_ids[assistant_idx]
-
-                # Only show buttons if feedback hasn't been submitted for this message
-                if client_request_id not in st.session_state.feedback_submitted:
-                    st.markdown("---")
-                    col1, col2, col3 = st.columns([1, 1, 10])
-                    with col1:
-                        if st.button("👍", key=f"thumbs_up_{idx}"):
-                            logger.info(f"User clicked thumbs up for message {idx}, client_request_id: {client_request_id}")
-                            success = log_user_feedback(client_request_id, True, user_id=user_info["user_id"])
-                            if success:
-                                st.session_state.feedback_submitted[client_request_id] = "positive"
-                                logger.info("Feedback logged successfully")
-                            else:
-                                st.error("Failed to submit feedback. Please check the logs.")
-                            st.rerun()
-                    with col2:
-                        if st.button("👎", key=f"thumbs_down_{idx}"):
-                            logger.info(f"User clicked thumbs down for message {idx}, client_request_id: {client_request_id}")
-                            success = log_user_feedback(client_request_id, False, user_id=user_info["user_id"])
-                            if success:
-                                st.session_state.feedback_submitted[client_request_id] = "negative"
-                                logger.info("Feedback logged successfully")
-                            else:
-                                st.error("Failed to submit feedback. Please check the logs.")
-                            st.rerun()
-                else:
-                    feedback_type = st.session_state.feedback_submitted[client_request_id]
-                    st.caption(f"✓ Feedback submitted: {feedback_type}")
+            # The client request ID is stored on the message when the response completes
+            client_request_id = message.get("client_request_id")
+
+            if client_request_id:
+                render_feedback(idx, client_request_id, user_info["user_id"])
 
 # Accept user input
 if prompt := st.chat_input("Ask me anything about your supply chain or finance data..."):
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
+    st.session_state.agent_input.append({"role": "user", "content": prompt})
 
     # Display user message in chat message container
     with st.chat_message("user"):
@@ -189,138 +430,37 @@ if prompt := st.chat_input("Ask me anything about your supply chain or finance d
 
     # Display assistant response in chat message container
     with st.chat_message("assistant"):
+        from mlflow.types.responses import ResponsesAgentRequest
+
         # Create request for the agent
-        request = ResponsesAgentRequest(
-            input=[{"role": msg["role"], "content": msg["content"]}
-                   for msg in st.session_state.messages]
-        )
+        request = ResponsesAgentRequest(input=st.session_state.agent_input)
 
         # Stream the response with full agent reasoning display
         try:
-            logger.info("Starting streaming response...")
-            event_count = 0
-
             # Track all response sections
-            sections = []  # List of tuples: (type, content)
-            current_text = ""
-            current_item_id = None
-            streamed_item_ids = set()  # Track which items we've streamed
+            renderer = SectionRenderer()
 
             # Single placeholder for updating display
             response_placeholder = st.empty()
 
-            for event in agent.predict_stream(request):
-                event_count += 1
-                logger.info(f"Event {event_count}: type={event.type}, event class={type(event).__name__}")
-
-                # Handle different event types from the Responses API
-                if event.type == "response.output_text.delta":
-                    # Accumulate text deltas for the current streaming message
-                    if hasattr(event, 'delta') and event.delta:
-                        if hasattr(event, 'item_id') and event.item_id != current_item_id:
-                            # New text stream starting
-                            if current_text:
-                                # Save previous text section
-                                sections.append(("text", current_text))
-                                streamed_item_ids.add(current_item_id)
-                            current_text = event.delta
-                            current_item_id = event.item_id
-                        else:
-                            current_text += event.delta
-
-                        # Update display (only during streaming text)
-                        markdown, _ = render_agent_response(sections, current_text)
-                        response_placeholder.markdown(markdown, unsafe_allow_html=True)
-
-                elif event.type == "response.output_item.done":
-                    # Save any accumulated text first
-                    if current_text:
-                        sections.append(("text", current_text))
-                        streamed_item_ids.add(current_item_id)
-                        current_text = ""
-                        current_item_id = None
-
-                    if hasattr(event, 'item'):
-                        item = event.item
-                        item_id = getattr(item, 'id', None)
-                        logger.info(f"Item type: {getattr(item, 'type', 'unknown')}, id: {item_id}")
-
-                        # Handle different item types
-                        if hasattr(item, 'type'):
-                            if item.type == 'function_call':
-                                # Show tool call
-                                tool_name = getattr(item, 'name', 'unknown')
-                                tool_args = getattr(item, 'arguments', '{}')
-                                sections.append(("tool_call", {"name": tool_name, "args": tool_args}))
-                                # Update display
-                                markdown, _ = render_agent_response(sections)
-                                response_placeholder.markdown(markdown, unsafe_allow_html=True)
-
-                            elif item.type == 'function_call_output':
-                                # Show tool output
-                                output = getattr(item, 'output', '')
-                                sections.append(("tool_output", output))
-                                # Update display
-                                markdown, _ = render_agent_response(sections)
-                                response_placeholder.markdown(markdown, unsafe_allow_html=True)
-
-                            elif item.type == 'message':
-                                # Only process message items that we haven't already streamed
-                                if item_id not in streamed_item_ids:
-                                    # Extract any complete text from message items
-                                    if hasattr(item, 'content'):
-                                        for content_item in item.content:
-                                            if hasattr(content_item, 'type') and content_item.type == 'output_text':
-                                                if hasattr(content_item, 'text'):
-                                                    # Check if this is agent name metadata (contains <name>)
-                                                    text = content_item.text
-                                                    if text.startswith('<name>') and text.endswith('</name>'):
-                                                        agent_name = text[6:-7]  # Extract name
-                                                        sections.append(("agent_name", agent_name))
-                                                        # Update display
-                                                        markdown, _ = render_agent_response(sections)
-                                                        response_placeholder.markdown(markdown, unsafe_allow_html=True)
-                                                    elif text != "EMPTY":
-                                                        # Add non-streamed message text
-                                                        sections.append(("text", text))
-                                                        # Update display
-                                                        markdown, _ = render_agent_response(sections)
-                                                        response_placeholder.markdown(markdown, unsafe_allow_html=True)
+            for markdown in stream_response_markdown(agent.predict_stream(request), renderer):
+                response_placeholder.markdown(markdown, unsafe_allow_html=True)
 
             # Final render without cursor
-            markdown, full_response = render_agent_response(sections)
-            response_placeholder.markdown(markdown, unsafe_allow_html=True)
-            logger.info(f"Stream complete. Total events: {event_count}, Sections: {len(sections)}")
+            full_response = renderer.text
+            response_placeholder.markdown(renderer.render(), unsafe_allow_html=True)
 
             # Store the client request ID for feedback tracking
+            client_request_id = None
             try:
                 logger.info("Retrieving client request ID from agent...")
                 client_request_id = agent.get_last_client_request_id()
                 if client_request_id:
                     logger.info(f"Client request ID retrieved: {client_request_id}")
 
-                    # Tag the most recent trace with this client_request_id
-                    try:
-                        from mlflow.tracking import MlflowClient
-                        client = MlflowClient()
-                        # Get experiment ID
-                        experiment_id = os.environ.get("MLFLOW_EXPERIMENT_ID", "0")
-                        # Search for the most recent trace (just created)
-                        recent_traces = client.search_traces(
-                            experiment_ids=[experiment_id],
-                            max_results=1,
-                            order_by=["timestamp DESC"]
-                        )
-                        if recent_traces:
-                            # Update the trace with client_request_id tag
-                            client.set_trace_tag(
-                                request_id=recent_traces[0].info.trace_id,
-                                key="client_request_id",
-                                value=client_request_id
-                            )
-                            logger.info(f"Tagged trace {recent_traces[0].info.trace_id} with client_request_id: {client_request_id}")
-                    except Exception as tag_error:
-                        logger.warning(f"Could not tag trace with client_request_id: {tag_error}")
+                    # Fallback until the endpoint is confirmed to record the x-request-id header on its trace;
+                    # runs on the background worker so the feedback buttons draw without waiting on MLflow
+                    tag_trace_with_client_request_id(client_request_id)
 
                     st.session_state.client_request_ids.append(client_request_id)
                     logger.info(f"Client request ID stored successfully. Total: {len(st.session_state.client_request_ids)}")
@@ -332,20 +472,31 @@ if prompt := st.chat_input("Ask me anything about your supply chain or finance d
         except Exception as e:
             logger.error(f"Error querying endpoint: {e}", exc_info=True)
             full_response = f"⚠️ Error: {str(e)}\n\nPlease check the endpoint configuration and try again."
+            client_request_id = None
             response_placeholder.markdown(full_response)
 
+        # Feedback buttons are drawn here once the response is stored, without a rerun
+        feedback_slot = st.container()
+
+    st.session_state.agent_input.append({"role": "assistant", "content": str(full_response)})
+
     # Add assistant response to chat history
     try:
         logger.info(f"Storing assistant response in session state (length: {len(full_response)})")
-        st.session_state.messages.append({"role": "assistant", "content": full_response})
+        st.session_state.messages.append(
+            {"role": "assistant", "content": full_response, "client_request_id": client_request_id}
+        )
         logger.info("Successfully stored assistant response")
-        # Trigger rerun to show feedback buttons
-        st.rerun()
     except Exception as e:
         logger.error(f"Error storing assistant response in session state: {e}", exc_info=True)
         # Try to store a simplified version
-        st.session_state.messages.append({"role": "assistant", "content": str(full_response)})
-        st.rerun()
+        st.session_state.messages.append(
+            {"role": "assistant", "content": str(full_response), "client_request_id": client_request_id}
+        )
+
+    if client_request_id:
+        with feedback_slot:
+            render_feedback(len(st.session_state.messages) - 1, client_request_id, user_info["user_id"])
 
 # Sidebar with additional information
 with st.sidebar:
@@ -369,6 +520,9 @@ with st.sidebar:
 
     if st.button("🔄 Clear Chat"):
         st.session_state.messages = []
+        st.session_state.agent_input = []
         st.session_state.client_request_ids = []
-        st.session_state.feedback_submitted = {}
+        st.session_state.feedback_submitted = set()
+        st.session_state.feedback_type = {}
+        st.session_state.feedback_futures = {}
         st.rerun()
@@ -1,17 +1,175 @@
-from typing import Generator, Optional
-from databricks.sdk import WorkspaceClient
+from typing import AsyncGenerator, Generator, Optional
+import httpx
 import mlflow
+from mlflow.entities.assessment import AssessmentSource, AssessmentSourceType
+from mlflow.exceptions import MlflowException
+from mlflow.protos.databricks_pb2 import INVALID_PARAMETER_VALUE, ErrorCode
 from mlflow.pyfunc import ResponsesAgent
+from mlflow.tracking import MlflowClient
 from mlflow.types.responses import (
     ResponsesAgentRequest,
     ResponsesAgentResponse,
     ResponsesAgentStreamEvent,
 )
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import functools
 import logging
+import os
+import queue
+import re
+import threading
+import time
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Experiment searched for feedback traces when no experiment_id is passed (default: experiment 0)
+_DEFAULT_EXPERIMENT_ID = os.environ.get("MLFLOW_EXPERIMENT_ID", "0")
+
+
+class _DatabricksAuth(httpx.Auth):
+    """httpx auth that adds Databricks SDK credentials to each request."""
+
+    def __init__(self, config):
+        self._config = config
+
+    def auth_flow(self, request):
+        request.headers.update(self._config.authenticate())
+        yield request
+
+
+# Connection pool settings for the shared serving endpoint clients: bounded connections with
+# keep-alive reuse. Streams get no read timeout so long agent responses are not cut off, but
+# sending the request and waiting for a pooled connection are bounded.
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+_HTTP_TIMEOUT = httpx.Timeout(connect=10.0, read=None, write=30.0, pool=30.0)
+# Non-streaming calls wait for the whole response, so they keep a finite read timeout
+# (OpenAI's default of 600 s)
+_PREDICT_TIMEOUT = httpx.Timeout(connect=10.0, read=600.0, write=30.0, pool=30.0)
+
+
+@functools.lru_cache(maxsize=1)
+def _workspace_config():
+    """Databricks SDK config (host and credentials), resolved once per process."""
+    from databricks.sdk import WorkspaceClient
+
+    return WorkspaceClient().config
+
+
+@functools.lru_cache(maxsize=1)
+def _shared_openai_client():
+    """OpenAI client for Databricks serving endpoints, shared by all agents so connections are reused."""
+    from openai import OpenAI
+
+    config = _workspace_config()
+    return OpenAI(
+        base_url=f"{config.host}/serving-endpoints",
+        api_key="no-token",  # Auth is added per request by _DatabricksAuth
+        timeout=_HTTP_TIMEOUT,
+        http_client=httpx.Client(auth=_DatabricksAuth(config), limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT),
+    )
+
+
+# AsyncOpenAI clients by event loop: httpx.AsyncClient connections are bound to the loop they were
+# opened on, so each loop gets its own client
+_async_openai_clients: dict = {}
+_async_openai_clients_lock = threading.Lock()
+
+
+def _shared_async_openai_client():
+    """
+    AsyncOpenAI client for Databricks serving endpoints, shared by all agents on the running loop.
+
+    A long-lived loop reuses one client and its connection pool; each asyncio.run() call gets a
+    fresh client. Clients of closed loops are dropped on the next call.
+    """
+    from openai import AsyncOpenAI
+
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        config = _workspace_config()
+        # Loops may run on different threads; the lock keeps pruning and insertion consistent
+        with _async_openai_clients_lock:
+            for closed in [other for other in _async_openai_clients if other.is_closed()]:
+                del _async_openai_clients[closed]
+            client = _async_openai_clients[loop] = AsyncOpenAI(
+                base_url=f"{config.host}/serving-endpoints",
+                api_key="no-token",  # Auth is added per request by _DatabricksAuth
+                timeout=_HTTP_TIMEOUT,
+                http_client=httpx.AsyncClient(auth=_DatabricksAuth(config), limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT),
+            )
+    return client
+
+
+@functools.lru_cache(maxsize=1)
+def _mlflow_client():
+    """MlflowClient shared by feedback logging calls."""
+    return MlflowClient()
+
+
+# Client request ID of the most recent predict_stream call in the current context; each Streamlit
+# session thread and each asyncio task sees its own value, so a shared agent does not mix them up
+_client_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "client_request_id", default=None
+)
+
+# Request header carrying the client request ID, for the serving endpoint to record on its trace as
+# trace.client_request_id. Until that is confirmed for every deployment (proxies may overwrite
+# x-request-id), tag_trace_with_client_request_id tags the trace as a fallback.
+_CLIENT_REQUEST_ID_HEADER = "x-request-id"
+
+# Stream item types that are not yielded to callers (function_call_output events trigger Pydantic warnings)
+_SKIP_ITEM_TYPES = frozenset({'function_call_output'})
+
+
+def _start_request() -> str:
+    """Generate a client request ID, make it the current context's last ID, and return it."""
+    client_request_id = f"req-{uuid.uuid4().hex[:8]}"
+    _client_request_id.set(client_request_id)
+    logger.info(f"Generated client request ID: {client_request_id}")
+    return client_request_id
+
+
+class _StreamFilter:
+    """
+    Per-request event handling shared by predict_stream and apredict_stream.
+
+    Drops _SKIP_ITEM_TYPES events and counts the rest for the completion log.
+    """
+
+    def __init__(self, client_request_id: str):
+        self.client_request_id = client_request_id
+        self.event_count = 0
+        self._debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        # Events are only counted for the completion log
+        self._count_enabled = logger.isEnabledFor(logging.INFO)
+
+    def keep(self, event) -> bool:
+        """Return True if the event should be yielded to the caller."""
+        if self._count_enabled:
+            self.event_count += 1
+
+        # Filter out problematic events (e.g. function_call_output) to avoid Pydantic warnings
+        try:
+            item_type = event.item.type
+        except AttributeError:
+            return True
+        if item_type in _SKIP_ITEM_TYPES:
+            # Log the handoff but don't yield the problematic event
+            if self._debug_enabled:
+                logger.debug("Skipping %s event: %s", item_type, getattr(event.item, 'output', ''))
+            return False
+        return True
+
+    def done(self):
+        """Log stream completion."""
+        if self._count_enabled:
+            logger.info(f"Completed streaming {self.event_count} events for client_request_id: {self.client_request_id}")
+
 
 class SimpleResponsesAgent(ResponsesAgent):
     """
@@ -28,9 +186,17 @@ class SimpleResponsesAgent(ResponsesAgent):
         Args:
             model: The name of the Databricks serving endpoint to query
         """
-        self.client = WorkspaceClient().serving_endpoints.get_open_ai_client()
+        self.client = _shared_openai_client()
         self.model = model
-        self.current_client_request_id: Optional[str] = None
+
+    def _create_kwargs(self, request: ResponsesAgentRequest, client_request_id: str, stream: bool) -> dict:
+        """Arguments for responses.create, sending the client request ID with the request."""
+        return {
+            "input": request.input,
+            "stream": stream,
+            "model": self.model,
+            "extra_headers": {_CLIENT_REQUEST_ID_HEADER: client_request_id},
+        }
 
     def predict_stream(
         self, request: ResponsesAgentRequest
@@ -45,40 +211,56 @@ class SimpleResponsesAgent(ResponsesAgent):
             ResponsesAgentStreamEvent objects as tokens arrive
 
         Note: No manual tracing - relies on serving endpoint's automatic tracing.
-        Client request ID is generated and stored for feedback tracking.
+        Client request ID is generated, sent with the request, and stored for feedback tracking.
         """
-        # Generate unique client request ID for this request
-        client_request_id = f"req-{uuid.uuid4().hex[:8]}"
-        self.current_client_request_id = client_request_id
-        logger.info(f"Generated client request ID: {client_request_id}")
-
+        stream_filter = _StreamFilter(_start_request())
         try:
-            event_count = 0
-
             for event in self.client.responses.create(
-                input=request.input, stream=True, model=self.model
+                **self._create_kwargs(request, stream_filter.client_request_id, stream=True)
             ):
-                event_count += 1
+                # Yield raw event objects directly without conversion
+                if stream_filter.keep(event):
+                    yield event
+            stream_filter.done()
+
+        except Exception as e:
+            logger.error(f"Error in predict_stream: {e}")
+            raise
+
+    async def apredict_stream(
+        self, request: ResponsesAgentRequest
+    ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        """
+        Query the endpoint with streaming enabled, without blocking the event loop.
 
-                # Filter out problematic function_call_output events to avoid Pydantic warnings
-                if hasattr(event, 'item') and hasattr(event.item, 'type'):
-                    if event.item.type == 'function_call_output':
-                        # Log the handoff but don't yield the problematic event
-                        logger.debug(f"Skipping function_call_output event: {getattr(event.item, 'output', '')}")
-                        continue
+        Async counterpart of predict_stream for asyncio servers handling many concurrent
+        sessions. Uses the AsyncOpenAI client of the running event loop, so it works both from
+        a long-lived loop and from a fresh asyncio.run() per call. The Streamlit app uses
+        predict_stream.
 
-                # Yield the raw event object directly without conversion
-                yield event
+        Args:
+            request: ResponsesAgentRequest containing the conversation input
 
-            logger.info(f"Completed streaming {event_count} events for client_request_id: {client_request_id}")
+        Yields:
+            ResponsesAgentStreamEvent objects as tokens arrive, as in predict_stream
+        """
+        stream_filter = _StreamFilter(_start_request())
+        try:
+            stream = await _shared_async_openai_client().responses.create(
+                **self._create_kwargs(request, stream_filter.client_request_id, stream=True)
+            )
+            async for event in stream:
+                if stream_filter.keep(event):
+                    yield event
+            stream_filter.done()
 
         except Exception as e:
-            logger.error(f"Error in predict_stream: {e}")
+            logger.error(f"Error in apredict_stream: {e}")
             raise
 
     def get_last_client_request_id(self) -> Optional[str]:
-        """Get the client request ID from the last predict_stream call."""
-        return self.current_client_request_id
+        """Get the client request ID from the last predict/predict_stream call in the current context."""
+        return _client_request_id.get()
 
     def predict(
         self, request: ResponsesAgentRequest
@@ -93,15 +275,34 @@ class SimpleResponsesAgent(ResponsesAgent):
             ResponsesAgentResponse with the complete response
         """
         response = self.client.responses.create(
-            input=request.input, stream=False, model=self.model
+            **self._create_kwargs(request, _start_request(), stream=False), timeout=_PREDICT_TIMEOUT
         )
         # Return the raw response object directly
         return response
 
+    def predict_text(self, request: ResponsesAgentRequest) -> str:
+        """
+        Query the endpoint without streaming and return only the final text.
+
+        Cheaper than consuming predict_stream when intermediate tokens are not displayed
+        (scripts, batch jobs): one response body instead of one chunk per token.
 
+        Args:
+            request: ResponsesAgentRequest containing the conversation input
+
+        Returns:
+            The concatenated output text of the response
+        """
+        return self.predict(request).output_text
+
+
+@functools.lru_cache(maxsize=8)
 def get_agent(endpoint_name: str) -> SimpleResponsesAgent:
     """
-    Factory function to create a ResponsesAgent instance.
+    Factory function returning the ResponsesAgent for an endpoint, created once per process.
+
+    Agents keep no per-request state (the client request ID lives in a ContextVar), so one
+    instance is safely shared by all callers of the same endpoint.
 
     Args:
         endpoint_name: Name of the Databricks serving endpoint
@@ -112,10 +313,122 @@ def get_agent(endpoint_name: str) -> SimpleResponsesAgent:
     return SimpleResponsesAgent(model=endpoint_name)
 
 
-def log_user_feedback(client_request_id: str, thumbs_up: bool, comment: str = "", user_id: str = "unknown", experiment_id: str = None):
+_CLIENT_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_.:-]+")
+
+# Trace filter templates, tried in order: native trace field, Databricks attributes syntax, legacy tag
+_CLIENT_REQUEST_ID_FILTER_TEMPLATES = (
+    "trace.client_request_id = '{}'",
+    "attributes.client_request_id = '{}'",
+    "tags.client_request_id = '{}'",
+)
+
+
+def _find_trace_by_client_request_id(client, experiment_id: str, client_request_id: str):
+    """
+    Look up the trace for a client request ID with a server-side filter.
+
+    Tries the native trace field first (including the Databricks-hosted attributes syntax),
+    then the client_request_id tag. Filters the tracking backend does not support are skipped;
+    if none are supported (e.g. a local file store), recent traces are paged through instead.
+
+    Returns:
+        The matching Trace, or None if no trace was found
+
+    Raises:
+        MlflowException: If a search fails for any reason other than an unsupported filter
+    """
+    filter_supported = False
+    for template in _CLIENT_REQUEST_ID_FILTER_TEMPLATES:
+        filter_string = template.format(client_request_id)
+        try:
+            traces = client.search_traces(
+                experiment_ids=[experiment_id],
+                filter_string=filter_string,
+                max_results=1,
+            )
+        except MlflowException as e:
+            # Only an invalid filter means the syntax is unsupported; other errors (network, auth,
+            # server) propagate instead of falling through to more searches and the scan
+            if e.error_code != ErrorCode.Name(INVALID_PARAMETER_VALUE):
+                raise
+            logger.debug(f"Trace filter not supported ({filter_string}): {e}")
+            continue
+        filter_supported = True
+        if traces:
+            return traces[0]
+
+    if filter_supported:
+        return None
+    return _scan_recent_traces(client, experiment_id, client_request_id)
+
+
+# Fallback scan for backends without client_request_id filters: page through a bounded time window
+_SCAN_WINDOW_MS = 60 * 60 * 1000
+_SCAN_PAGE_SIZE = 100
+_SCAN_FILTER_TEMPLATE = "attributes.timestamp_ms > {}"
+_ORDER_BY = ("timestamp DESC",)
+
+
+def _scan_recent_traces(client, experiment_id: str, client_request_id: str):
+    """Page through traces from the last _SCAN_WINDOW_MS and match client_request_id client-side."""
+    since_ms = int(time.time() * 1000) - _SCAN_WINDOW_MS
+    page_token = None
+    while True:
+        page = client.search_traces(
+            experiment_ids=[experiment_id],
+            filter_string=_SCAN_FILTER_TEMPLATE.format(since_ms),
+            max_results=_SCAN_PAGE_SIZE,
+            order_by=_ORDER_BY,
+            page_token=page_token,
+        )
+        for trace in page:
+            if (getattr(trace.info, 'client_request_id', None) == client_request_id
+                    or trace.info.tags.get('client_request_id') == client_request_id):
+                return trace
+        page_token = page.token
+        if not page_token:
+            return None
+
+
+def _tag_most_recent_trace(client_request_id: str, experiment_id: str = None) -> bool:
+    """
+    Tag the most recent trace in the experiment with a client request ID.
+
+    Fallback for endpoints that do not record the x-request-id header as trace.client_request_id;
+    feedback lookup tries the native field first and the tag after it.
+
+    Returns:
+        True if a trace was tagged, False otherwise
+    """
+    experiment_id = experiment_id or _DEFAULT_EXPERIMENT_ID
+    client = _mlflow_client()
+    try:
+        # Search for the most recent trace (just created)
+        recent_traces = client.search_traces(
+            experiment_ids=[experiment_id],
+            max_results=1,
+            order_by=_ORDER_BY,
+        )
+        if not recent_traces:
+            return False
+        client.set_trace_tag(
+            request_id=recent_traces[0].info.trace_id,
+            key="client_request_id",
+            value=client_request_id,
+        )
+        logger.info(f"Tagged trace {recent_traces[0].info.trace_id} with client_request_id: {client_request_id}")
+        return True
+    except Exception as e:
+        logger.warning(f"Could not tag trace with client_request_id: {e}")
+        return False
+
+
+def _log_feedback_to_trace(client_request_id: str, thumbs_up: bool, comment: str = "", user_id: str = "unknown", experiment_id: str = None):
     """
     Log user feedback for a specific trace to MLflow using client request ID.
 
+    Runs on the feedback worker thread; see log_user_feedback.
+
     Args:
         client_request_id: The client request ID to find the trace
         thumbs_up: True for positive feedback, False for negative
@@ -126,42 +439,18 @@ def log_user_feedback(client_request_id: str, thumbs_up: bool, comment: str = ""
     Returns:
         True if feedback was logged successfully, False otherwise
     """
-    from mlflow.entities.assessment import AssessmentSource, AssessmentSourceType
-    from mlflow.tracking import MlflowClient
-    import os
-
     try:
         logger.info(f"Attempting to log feedback for client_request_id: {client_request_id}, thumbs_up: {thumbs_up}, user_id: {user_id}")
 
         # Get experiment ID from env if not provided
-        if experiment_id is None:
-            experiment_id = os.environ.get("MLFLOW_EXPERIMENT_ID", "0")  # Default to experiment 0
-            logger.info(f"Using experiment_id: {experiment_id}")
+        experiment_id = experiment_id or _DEFAULT_EXPERIMENT_ID
 
-        # Search for trace using client_request_id
-        # Note: The Databricks docs show using filter_string with 'attributes.client_request_id',
-        # but this doesn't work in local MLflow (only in Databricks-hosted MLflow).
-        # We search recent traces and filter manually instead.
-        client = MlflowClient()
-
-        # Search recent traces and filter manually by client_request_id
-        recent_traces = client.search_traces(
-            experiment_ids=[experiment_id],
-            max_results=50,  # Search recent traces
-            order_by=["timestamp DESC"]
-        )
+        # The ID is interpolated into a filter string, so only accept the characters we generate
+        if not _CLIENT_REQUEST_ID_PATTERN.fullmatch(client_request_id):
+            logger.error(f"Invalid client_request_id: {client_request_id!r}")
+            return False
 
-        # Find matching trace by checking tags
-        matching_trace = None
-        for trace in recent_traces:
-            # Check both trace.info.client_request_id (from mlflow.update_current_trace)
-            # and trace.info.tags (from mlflow.update_trace with tags)
-            if hasattr(trace.info, 'client_request_id') and trace.info.client_request_id == client_request_id:
-                matching_trace = trace
-                break
-            elif hasattr(trace.info, 'tags') and trace.info.tags.get('client_request_id') == client_request_id:
-                matching_trace = trace
-                break
+        matching_trace = _find_trace_by_client_request_id(_mlflow_client(), experiment_id, client_request_id)
 
         if not matching_trace:
             logger.error(f"No trace found for client_request_id: {client_request_id} in experiment {experiment_id}")
@@ -187,3 +476,86 @@ def log_user_feedback(client_request_id: str, thumbs_up: bool, comment: str = ""
     except Exception as e:
         logger.error(f"Failed to log feedback for client_request_id {client_request_id}: {e}", exc_info=True)
         return False
+
+
+# Trace tagging and feedback are handled on one background worker so the UI doesn't block on MLflow
+# round trips. Each item is (future, fn, args); the future receives fn's result. Items run in order,
+# so a request's tag is always applied before feedback for it is looked up.
+_feedback_queue: "queue.Queue[tuple]" = queue.Queue()
+
+# Upper bound on how long process exit waits for queued feedback (e.g. while MLflow is unreachable)
+_FEEDBACK_EXIT_TIMEOUT_S = 10.0
+
+
+def _drain_feedback_queue():
+    """Run queued tagging and feedback calls against MLflow, one item at a time."""
+    while True:
+        future, fn, args = _feedback_queue.get()
+        try:
+            if future.set_running_or_notify_cancel():
+                future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            _feedback_queue.task_done()
+
+
+threading.Thread(target=_drain_feedback_queue, name="feedback-logger", daemon=True).start()
+
+
+def log_user_feedback(client_request_id: str, thumbs_up: bool, comment: str = "", user_id: str = "unknown", experiment_id: str = None):
+    """
+    Queue user feedback for a specific trace to be logged to MLflow in the background.
+
+    Args:
+        client_request_id: The client request ID to find the trace
+        thumbs_up: True for positive feedback, False for negative
+        comment: Optional text comment from the user
+        user_id: User identifier (email, username, etc.)
+        experiment_id: MLflow experiment ID to search in (uses MLFLOW_EXPERIMENT_ID env var if not provided)
+
+    Returns:
+        Future resolving to True if the feedback was logged, False if it could not be
+        (e.g. no trace was found for client_request_id)
+    """
+    future = concurrent.futures.Future()
+    _feedback_queue.put((future, _log_feedback_to_trace, (client_request_id, thumbs_up, comment, user_id, experiment_id)))
+    logger.info(f"Queued feedback for client_request_id: {client_request_id}")
+    return future
+
+
+def tag_trace_with_client_request_id(client_request_id: str, experiment_id: str = None):
+    """
+    Queue tagging of the just-completed request's trace with its client request ID.
+
+    Call right after streaming ends: the worker tags the most recent trace in the experiment, as a
+    fallback until the endpoint is confirmed to record the x-request-id header on its trace.
+
+    Args:
+        client_request_id: The client request ID sent with the request
+        experiment_id: MLflow experiment ID (uses MLFLOW_EXPERIMENT_ID env var if not provided)
+
+    Returns:
+        Future resolving to True if a trace was tagged, False otherwise
+    """
+    future = concurrent.futures.Future()
+    _feedback_queue.put((future, _tag_most_recent_trace, (client_request_id, experiment_id)))
+    return future
+
+
+def flush_feedback(timeout: Optional[float] = None) -> bool:
+    """
+    Block until all queued tagging and feedback has been processed.
+
+    Args:
+        timeout: Maximum seconds to wait, or None to wait indefinitely
+
+    Returns:
+        True if the queue drained, False if the timeout elapsed first
+    """
+    with _feedback_queue.all_tasks_done:
+        return _feedback_queue.all_tasks_done.wait_for(lambda: not _feedback_queue.unfinished_tasks, timeout)
+
+
+# Flush in-flight feedback before the process exits, without hanging shutdown indefinitely
+atexit.register(flush_feedback, _FEEDBACK_EXIT_TIMEOUT_S)
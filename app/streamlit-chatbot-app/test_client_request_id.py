@@ -1,11 +1,13 @@
 """
 Test the updated model_serving_utils with client_request_id approach.
 This validates that:
-1. Client request IDs are generated and tagged to traces
-2. Traces can be found by client_request_id
+1. Client request IDs are generated and sent with the request (x-request-id header)
+2. The endpoint records the ID on its trace: traces are found by trace.client_request_id
+   without the app's tagging fallback
 3. Feedback can be logged successfully
 """
 import os
+import sys
 import time
 import mlflow
 from model_serving_utils import get_agent, log_user_feedback
@@ -41,10 +43,13 @@ test_request = ResponsesAgentRequest(
 )
 
 try:
-    full_response = ""
+    # Stream like the app does, so the header and ContextVar paths are exercised
+    chunks = []
     for event in agent.predict_stream(test_request):
-        if hasattr(event, 'delta') and event.delta:
-            full_response += event.delta
+        delta = getattr(event, 'delta', None)
+        if delta:
+            chunks.append(delta)
+    full_response = "".join(chunks)
 
     client_request_id = agent.get_last_client_request_id()
     print(f"✓ Client request ID: {client_request_id}")
@@ -52,100 +57,93 @@ try:
 
     if not client_request_id:
         print("✗ FAILED: No client_request_id captured!")
-        exit(1)
+        sys.exit(1)
 
-except Exception as e:
-    print(f"✗ FAILED: {e}")
-    exit(1)
+except Exception:
+    logger.exception("✗ FAILED")
+    sys.exit(1)
 
 # Test 2: Search for trace by client_request_id
 print("\n[TEST 2] Search for trace by client_request_id")
 print("-"*80)
 
 try:
-    # Give MLflow a moment to index the trace
-    print("Waiting 3 seconds for trace to be indexed...")
-    time.sleep(3)
-
     # Use the configured experiment ID
     client = MlflowClient()
 
-    # Search recent traces and filter manually
-    recent_traces = client.search_traces(
-        experiment_ids=[EXPERIMENT_ID],
-        max_results=50,
-        order_by=["timestamp DESC"]
-    )
-
-    # Find matching trace
-    matching_trace = None
-    for trace in recent_traces:
-        if hasattr(trace.info, 'client_request_id') and trace.info.client_request_id == client_request_id:
-            matching_trace = trace
+    # Poll the server-side filter with exponential backoff until the trace is indexed
+    print("Waiting up to 5 seconds for trace to be indexed...")
+    deadline = time.monotonic() + 5
+    delay = 0.1
+    while True:
+        matching_traces = client.search_traces(
+            experiment_ids=[EXPERIMENT_ID],
+            filter_string=f"trace.client_request_id = '{client_request_id}'",
+            max_results=1
+        )
+        if matching_traces or time.monotonic() >= deadline:
             break
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
 
-    if matching_trace:
+    if matching_traces:
+        trace_id = matching_traces[0].info.trace_id
         print(f"✓ Found trace!")
-        print(f"  Trace ID: {matching_trace.info.trace_id}")
-        print(f"  Client request ID from trace: {matching_trace.info.client_request_id}")
+        print(f"  Trace ID: {trace_id}")
+        print(f"  Client request ID from trace: {matching_traces[0].info.client_request_id}")
     else:
         print(f"✗ FAILED: No trace found for client_request_id: {client_request_id}")
         print("\nDebugging - searching for recent traces:")
-        for i, t in enumerate(recent_traces[:5]):
+        recent_traces = client.search_traces(
+            experiment_ids=[EXPERIMENT_ID],
+            max_results=5,
+            order_by=["timestamp DESC"]
+        )
+        for i, t in enumerate(recent_traces):
             print(f"\n  Trace {i+1}:")
             print(f"    Trace ID: {t.info.trace_id}")
             print(f"    Client request ID: {getattr(t.info, 'client_request_id', 'N/A')}")
-        exit(1)
+        sys.exit(1)
 
-except Exception as e:
-    print(f"✗ FAILED: Error searching for trace: {e}")
-    import traceback
-    traceback.print_exc()
-    exit(1)
+except Exception:
+    logger.exception("✗ FAILED: Error searching for trace")
+    sys.exit(1)
 
 # Test 3: Log feedback using client_request_id
 print("\n[TEST 3] Log feedback using client_request_id")
 print("-"*80)
 
 try:
-    success = log_user_feedback(
+    future = log_user_feedback(
         client_request_id=client_request_id,
         thumbs_up=True,
         comment="Test feedback from test script",
         user_id="test_user@example.com"
     )
 
+    # Feedback is logged on a background thread; wait for its outcome before verifying
+    success = future.result(timeout=60)
+
     if success:
         print("✓ Feedback logged successfully!")
 
-        # Verify feedback was attached - search again for the trace
-        recent_traces = client.search_traces(
-            experiment_ids=[EXPERIMENT_ID],
-            max_results=50,
-            order_by=["timestamp DESC"]
-        )
-
-        matching_trace = None
-        for trace in recent_traces:
-            if hasattr(trace.info, 'client_request_id') and trace.info.client_request_id == client_request_id:
-                matching_trace = trace
-                break
+        # Verify feedback was attached - fetch the known trace directly
+        trace = client.get_trace(trace_id)
+        assessments = getattr(trace.info, 'assessments', None)
 
-        if matching_trace and hasattr(matching_trace.data, 'assessments') and matching_trace.data.assessments:
-            print(f"  Assessments found: {len(matching_trace.data.assessments)}")
-            for assessment in matching_trace.data.assessments:
+        if assessments:
+            print(f"  Assessments found: {len(assessments)}")
+            for assessment in assessments:
                 print(f"    - {assessment.name}: {assessment.value}")
         else:
             print("  Note: Assessments may take a moment to appear in search results")
     else:
         print("✗ FAILED: Feedback logging returned False")
-        exit(1)
+        sys.exit(1)
 
-except Exception as e:
-    print(f"✗ FAILED: Error logging feedback: {e}")
-    import traceback
-    traceback.print_exc()
-    exit(1)
+except Exception:
+    logger.exception("✗ FAILED: Error logging feedback")
+    sys.exit(1)
 
 print("\n" + "="*80)
 print("SUCCESS! All tests passed.")
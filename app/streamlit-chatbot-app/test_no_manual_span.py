@@ -31,7 +31,7 @@ client = WorkspaceClient().serving_endpoints.get_open_ai_client()
 print("\n[APPROACH 1] Check for active span DURING streaming")
 print("-"*80)
 try:
-    full_response = ""
+    chunks = []
     trace_id_during_stream = None
 
     for i, event in enumerate(client.responses.create(
@@ -39,8 +39,9 @@ try:
         stream=True,
         model=SERVING_ENDPOINT
     )):
-        if hasattr(event, 'delta') and event.delta:
-            full_response += event.delta
+        delta = getattr(event, 'delta', None)
+        if delta:
+            chunks.append(delta)
 
         # Try to capture active span on first event
         if i == 0:
@@ -54,6 +55,7 @@ try:
             except Exception as e:
                 print(f"✗ Error checking active span: {e}")
 
+    full_response = "".join(chunks)
     print(f"Response: {full_response[:100]}...")
     print(f"Trace ID captured: {trace_id_during_stream}")
 
@@ -67,15 +69,16 @@ print("-"*80)
 @mlflow.trace
 def query_with_trace_decorator(client, request, model):
     """Query with automatic MLflow tracing via decorator."""
-    full_response = ""
+    chunks = []
     for event in client.responses.create(
         input=request.input,
         stream=True,
         model=model
     ):
-        if hasattr(event, 'delta') and event.delta:
-            full_response += event.delta
-    return full_response
+        delta = getattr(event, 'delta', None)
+        if delta:
+            chunks.append(delta)
+    return "".join(chunks)
 
 try:
     response = query_with_trace_decorator(client, test_request, SERVING_ENDPOINT)
@@ -108,7 +111,7 @@ try:
     except:
         print("✓ No parent span (clean state)")
 
-    full_response = ""
+    chunks = []
     with mlflow.start_span(name="test_span") as span:
         our_trace_id = span.trace_id
         print(f"Our span trace ID: {our_trace_id}")
@@ -118,8 +121,9 @@ try:
             stream=True,
             model=SERVING_ENDPOINT
         ):
-            if hasattr(event, 'delta') and event.delta:
-                full_response += event.delta
+            delta = getattr(event, 'delta', None)
+            if delta:
+                chunks.append(delta)
 
         # Check if serving endpoint created a different trace
         try:
@@ -131,6 +135,7 @@ try:
         except:
             pass
 
+    full_response = "".join(chunks)
     print(f"Response: {full_response[:100]}...")
 
 except Exception as e:
@@ -29,15 +29,16 @@ print(f"Serving Endpoint: {SERVING_ENDPOINT}\n")
 print(f"Testing NO manual tracing approach with endpoint: {SERVING_ENDPOINT}\n")
 print("="*80)
 
-# Get initial trace count
 client = MlflowClient()
-initial_traces = client.search_traces(
+
+# Traces newer than the current newest trace are attributed to the query below. Anchoring on a
+# server-side timestamp avoids missing traces when the local clock runs ahead of the server.
+latest_traces = client.search_traces(
     experiment_ids=[EXPERIMENT_ID],
-    max_results=10,
+    max_results=1,
     order_by=["timestamp DESC"]
 )
-initial_count = len(initial_traces)
-print(f"Initial trace count: {initial_count}")
+start_ms = latest_traces[0].info.timestamp_ms if latest_traces else 0
 
 # Make a query
 print("\n[TEST] Query endpoint without manual tracing")
@@ -49,28 +50,44 @@ test_request = ResponsesAgentRequest(
 )
 
 try:
-    full_response = ""
+    # Stream like the app does, so the header and ContextVar paths are exercised
+    chunks = []
     for event in agent.predict_stream(test_request):
-        if hasattr(event, 'delta') and event.delta:
-            full_response += event.delta
+        delta = getattr(event, 'delta', None)
+        if delta:
+            chunks.append(delta)
+    full_response = "".join(chunks)
 
     client_request_id = agent.get_last_client_request_id()
     print(f"✓ Client request ID: {client_request_id}")
     print(f"Response preview: {full_response[:100]}...")
 
-    # Wait a moment for trace to be indexed
-    time.sleep(2)
-
-    # Check how many NEW traces were created
-    new_traces = client.search_traces(
-        experiment_ids=[EXPERIMENT_ID],
-        max_results=10,
-        order_by=["timestamp DESC"]
-    )
-    new_count = len([t for t in new_traces if t not in initial_traces])
+    # Check how many NEW traces were created. A duplicate trace may be indexed later than the
+    # first one, so keep polling (with exponential backoff) until the count has been stable for
+    # SETTLE_S seconds, or the deadline passes
+    SETTLE_S = 3
+    deadline = time.monotonic() + 15
+    delay = 0.1
+    new_count = -1
+    stable_since = time.monotonic()
+    while True:
+        new_traces = client.search_traces(
+            experiment_ids=[EXPERIMENT_ID],
+            filter_string=f"attributes.timestamp_ms > {start_ms}",
+            max_results=10
+        )
+        now = time.monotonic()
+        if len(new_traces) != new_count:
+            new_count = len(new_traces)
+            stable_since = now
+        elif new_count and now - stable_since >= SETTLE_S:
+            break
+        if now >= deadline:
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
 
     print(f"\n📊 Trace Analysis:")
-    print(f"  Traces before query: {initial_count}")
     print(f"  New traces created: {new_count}")
 
     if new_count == 1:
@@ -85,15 +102,13 @@ try:
 
         # Show the traces
         print(f"\n  Recent traces:")
-        for i, trace in enumerate(new_traces[:new_count]):
+        for i, trace in enumerate(new_traces):
             print(f"    {i+1}. {trace.info.trace_id}")
             print(f"       Name: {trace.info.tags.get('mlflow.traceName', 'N/A')}")
             if hasattr(trace.info, 'client_request_id'):
                 print(f"       Client Request ID: {trace.info.client_request_id}")
 
-except Exception as e:
-    print(f"✗ FAILED: {e}")
-    import traceback
-    traceback.print_exc()
+except Exception:
+    logger.exception("✗ FAILED")
 
 print("\n" + "="*80)
@@ -31,7 +31,7 @@ print("\n[TEST] Query endpoint and capture response ID")
 print("-"*80)
 
 # Make a simple call without any manual tracing
-full_response = ""
+chunks = []
 response_id = None
 event_ids = []
 
@@ -40,8 +40,9 @@ for event in client.responses.create(
     stream=True,
     model=SERVING_ENDPOINT
 ):
-    if hasattr(event, 'delta') and event.delta:
-        full_response += event.delta
+    delta = getattr(event, 'delta', None)
+    if delta:
+        chunks.append(delta)
 
     # Capture IDs from events
     if hasattr(event, 'id'):
@@ -52,6 +53,8 @@ for event in client.responses.create(
         response_id = event.item_id
         print(f"✓ Found item_id from event: {response_id}")
 
+full_response = "".join(chunks)
+
 print(f"\nResponse preview: {full_response[:100]}...")
 print(f"\nUnique event IDs collected: {set(event_ids)}")
 
@@ -72,11 +75,10 @@ if hasattr(response, '_request_id'):
 
 # Check all id-like attributes
 print(f"\nAll ID-related attributes:")
-for attr in dir(response):
-    if 'id' in attr.lower() and not attr.startswith('_'):
-        val = getattr(response, attr, None)
-        if val and isinstance(val, str):
-            print(f"  {attr}: {val}")
+for attr in ('id', 'response_id', 'request_id', 'trace_id'):
+    val = getattr(response, attr, None)
+    if val:
+        print(f"  {attr}: {val}")
 
 print("\n" + "="*80)
 print("HYPOTHESIS TEST")
@@ -3,131 +3,192 @@ Test script to explore different ways of capturing trace IDs from serving endpoi
 Run this to understand which approach correctly captures the endpoint's trace ID.
 """
 import os
+import sys
+
+# Check configuration before the heavy mlflow imports so misconfigured runs fail fast
+SERVING_ENDPOINT = os.environ.get("SERVING_ENDPOINT")
+
+if not SERVING_ENDPOINT:
+    sys.stderr.write("ERROR: Set SERVING_ENDPOINT environment variable\n")
+    sys.exit(1)
+
+import contextvars
+import json
+import logging
+import queue
+from collections import defaultdict
+
 import mlflow
 from model_serving_utils import get_agent
 from mlflow.types.responses import ResponsesAgentRequest
-import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-SERVING_ENDPOINT = os.environ.get("SERVING_ENDPOINT")
+PREVIEW_CHARS = 100
 
-if not SERVING_ENDPOINT:
-    print("ERROR: Set SERVING_ENDPOINT environment variable")
-    exit(1)
+# Trace-related attributes probed on response events
+TRACE_ATTRS = ('trace_id', 'request_id', 'id', 'metadata', 'headers')
 
-print(f"Testing with endpoint: {SERVING_ENDPOINT}\n")
-print("="*80)
+# Sentinel distinguishing absent attributes from attributes set to None
+_MISSING = object()
 
-# Test message
-test_request = ResponsesAgentRequest(
-    input=[{"role": "user", "content": "Hello, what is 2+2?"}]
-)
+# Test message, built once; model_construct skips validation of this fixed, known-good input
+_INPUT = ({"role": "user", "content": "Hello, what is 2+2?"},)
+TEST_REQUEST = ResponsesAgentRequest.model_construct(input=list(_INPUT))
 
-# Test 1: Current approach with manual span
-print("\n[TEST 1] Current approach: Manual span wrapper")
-print("-"*80)
 agent = get_agent(SERVING_ENDPOINT)
-trace_ids_collected = []
+# Trace IDs of root spans created in this process. MLflow applies span processors when a span
+# ends, so each trace ID is pushed once its root span (i.e. the client-side trace) finishes
+root_trace_ids = queue.SimpleQueue()
 
-try:
-    full_response = ""
-    for event in agent.predict_stream(test_request):
-        if hasattr(event, 'delta') and event.delta:
-            full_response += event.delta
 
-    manual_span_trace_id = agent.get_last_trace_id()
-    print(f"✓ Manual span trace ID: {manual_span_trace_id}")
-    trace_ids_collected.append(("Manual Span", manual_span_trace_id))
+def _capture_root_span(span):
+    if span.parent_id is None:
+        root_trace_ids.put(span.trace_id)
 
-    # Try getting active span after streaming
-    try:
-        active_span = mlflow.get_current_active_span()
-        if active_span:
-            active_trace_id = active_span.trace_id
-            print(f"✓ Active span trace ID (after stream): {active_trace_id}")
-            trace_ids_collected.append(("Active Span After", active_trace_id))
-        else:
-            print("✗ No active span found after streaming")
-    except Exception as e:
-        print(f"✗ Error getting active span: {e}")
 
-    print(f"Response preview: {full_response[:100]}...")
+# Span processors need a recent mlflow; without them Test 1 reports the hook as unavailable
+span_hook_installed = hasattr(mlflow.tracing, "configure")
+if span_hook_installed:
+    mlflow.tracing.configure(span_processors=[_capture_root_span])
 
-except Exception as e:
-    print(f"✗ Test 1 failed: {e}")
+# Trace the OpenAI calls on the client too, so the hook sees the client-side trace of the request
+# and Test 1 can compare its ID with the IDs the endpoint reports. This logs a client-side trace
+# to the active experiment, which the app itself deliberately does not do.
+mlflow.openai.autolog()
 
-# Test 2: Check if response object has trace metadata
-print("\n[TEST 2] Inspecting response object metadata")
-print("-"*80)
-try:
-    agent2 = get_agent(SERVING_ENDPOINT)
-    response_events = []
+# Sources that reported each trace ID, in the order first seen
+trace_ids = defaultdict(list)
 
-    for event in agent2.client.responses.create(
-        input=test_request.input,
-        stream=True,
-        model=SERVING_ENDPOINT
-    ):
-        response_events.append(event)
+# All observations are gathered here and logged once as JSON at the end
+report = {"endpoint": SERVING_ENDPOINT, "tests": {}, "trace_ids": trace_ids}
 
-        # Check first event for metadata
-        if len(response_events) == 1:
-            print(f"Event type: {type(event)}")
-            print(f"Event attributes: {dir(event)}")
+# Record the HTTP response headers of endpoint calls, keyed by the request's client request ID,
+# so trace correlation headers can be read without issuing extra requests
+response_headers = {}
 
-            # Check for common trace-related attributes
-            for attr in ['trace_id', 'request_id', 'id', 'metadata', 'headers']:
-                if hasattr(event, attr):
-                    val = getattr(event, attr)
-                    print(f"  - {attr}: {val}")
 
-    print(f"✓ Processed {len(response_events)} events")
+def _capture_headers(response):
+    response_headers[response.request.headers.get("x-request-id")] = response.headers
 
-except Exception as e:
-    print(f"✗ Test 2 failed: {e}")
 
-# Test 3: Non-streaming to compare
-print("\n[TEST 3] Non-streaming response (for comparison)")
-print("-"*80)
-try:
-    agent3 = get_agent(SERVING_ENDPOINT)
-    response = agent3.predict(test_request)
+agent.client._client.event_hooks["response"].append(_capture_headers)
+
 
-    print(f"Response type: {type(response)}")
-    print(f"Response attributes: {dir(response)}")
+def _consume_stream():
+    """
+    Stream TEST_REQUEST once, keeping only the first event, the event count and a preview.
 
-    # Check for trace-related attributes
-    for attr in ['trace_id', 'request_id', 'id', 'metadata']:
-        if hasattr(response, attr):
-            val = getattr(response, attr)
-            print(f"  - {attr}: {val}")
-            if 'trace' in attr.lower() or 'id' in attr.lower():
-                trace_ids_collected.append((f"Non-streaming {attr}", val))
+    Returns:
+        Tuple of (first_event, event_count, client_request_id, preview)
+    """
+    first_event = None
+    event_count = 0
+    # Only a preview is reported, so stop collecting text once it is filled
+    chunks = []
+    preview_len = 0
+    for i, event in enumerate(agent.predict_stream(TEST_REQUEST)):
+        if i == 0:
+            first_event = event
+        event_count = i + 1
+        delta = getattr(event, 'delta', None)
+        if delta and preview_len < PREVIEW_CHARS:
+            chunks.append(delta)
+            preview_len += len(delta)
+
+    # Read in the same context predict_stream set the ID in
+    return first_event, event_count, agent.get_last_client_request_id(), ''.join(chunks)[:PREVIEW_CHARS]
+
+
+# A single streaming request; all three tests below inspect this one response. It runs in a
+# copied context so contextvars set while streaming stay with this request
+first_event = None
+event_count = 0
+client_request_id = None
+
+try:
+    first_event, event_count, client_request_id, report["response_preview"] = (
+        contextvars.copy_context().run(_consume_stream)
+    )
 
 except Exception as e:
-    print(f"✗ Test 3 failed: {e}")
-
-# Summary
-print("\n" + "="*80)
-print("TRACE ID SUMMARY")
-print("="*80)
-if trace_ids_collected:
-    for source, trace_id in trace_ids_collected:
-        print(f"{source:30} -> {trace_id}")
-
-    # Check if all trace IDs are the same
-    unique_traces = set([tid for _, tid in trace_ids_collected if tid])
-    if len(unique_traces) == 1:
-        print("\n✓ All trace IDs match - good!")
-    else:
-        print(f"\n⚠ WARNING: Found {len(unique_traces)} different trace IDs!")
-        print("This likely explains why you're seeing multiple traces in Databricks.")
-else:
-    print("✗ No trace IDs collected")
+    report["stream_error"] = str(e)
 
-print("\nNext steps:")
-print("1. Check the Databricks MLflow UI for these trace IDs")
-print("2. Note which trace ID(s) appear under service principal vs user")
-print("3. Use the correct trace ID approach in the app")
+
+def _run(name, fn, **initial):
+    """Run one test, recording its findings (or its error) under report["tests"][name]."""
+    result = report["tests"][name] = dict(initial)
+    try:
+        fn(result)
+    except Exception as e:
+        result["error"] = str(e)
+
+
+def _client_ids(result):
+    """Test 1: IDs known to the client after streaming."""
+    # Root spans of the client-side (autologged) traces created while streaming
+    if not span_hook_installed:
+        result["client_root_trace_ids"] = "span processors unavailable in this mlflow version"
+        return
+    client_trace_ids = result["client_root_trace_ids"] = []
+    while not root_trace_ids.empty():
+        client_trace_id = root_trace_ids.get_nowait()
+        client_trace_ids.append(client_trace_id)
+        trace_ids[client_trace_id].append("Client Root Span")
+
+
+def _event_metadata(result):
+    """Test 2: Check if response events have trace metadata."""
+    if first_event is None:
+        return
+    result["event_type"] = type(first_event).__name__
+
+    # Check for common trace-related attributes
+    attributes = result["attributes"] = {}
+    for attr in TRACE_ATTRS:
+        val = getattr(first_event, attr, _MISSING)
+        if val is _MISSING:
+            continue
+        attributes[attr] = val
+
+
+def _response_headers(result):
+    """Test 3: Check the HTTP response headers for trace correlation."""
+    headers = response_headers.get(client_request_id, {})
+
+    # Check for trace-related headers
+    for name in ['x-request-id', 'traceparent', 'x-databricks-trace-id']:
+        if name in headers:
+            val = headers[name]
+            result[name] = val
+            if name != 'x-request-id':
+                trace_ids[val].append(f"Header {name}")
+
+
+_run("client_ids", _client_ids, client_request_id=client_request_id)
+_run("event_metadata", _event_metadata, event_count=event_count)
+_run("response_headers", _response_headers)
+
+# Serializing the report is skipped entirely when INFO logging is disabled
+if logger.isEnabledFor(logging.INFO):
+    logger.info("trace_capture_report %s", json.dumps(report, default=str))
+
+# Summary: one pass over the grouped IDs builds a single log record with the verdict
+summary = [f"Trace ID {trace_id} <- {', '.join(sources)}" for trace_id, sources in trace_ids.items()]
+if not summary:
+    logger.warning("No trace IDs collected")
+elif len(summary) == 1:
+    logger.info("%s\nAll trace IDs match - good!", summary[0])
+else:
+    logger.warning(
+        "%s\nFound %d different trace IDs! This likely explains why you're seeing multiple traces in Databricks.",
+        "\n".join(summary), len(summary),
+    )
+
+print(
+    "\nNext steps:\n"
+    "1. Check the Databricks MLflow UI for these trace IDs\n"
+    "2. Note which trace ID(s) appear under service principal vs user\n"
+    "3. Use the correct trace ID approach in the app"
+)